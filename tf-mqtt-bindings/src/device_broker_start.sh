@@ -1,7 +1,9 @@
 #!/bin/bash
 
-python src/tinkerforge_mqtt.py --debug \
+PYTHONPATH=src python -m tinkerforge_mqtt --debug \
  --show-payload \
  --global-topic-prefix tf \
  --broker-host 127.0.0.1 \
- --broker-port 1883
+ --broker-port 1883 \
+ --registration-file /data/registrations.json \
+ --capture-file /data/capture.tfpcap
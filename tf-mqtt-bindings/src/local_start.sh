@@ -1,6 +1,6 @@
 #!/bin/bash
 
-python3 tinkerforge_mqtt.py --debug \
+python3 -m tinkerforge_mqtt --debug \
  --show-payload \
  --global-topic-prefix DTCK/$GLOBAL_TOPIC_PREFIX \
  --broker-host $BROKER_HOST \
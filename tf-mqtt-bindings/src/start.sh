@@ -1,6 +1,6 @@
 #!/bin/bash
 
-python src/tinkerforge_mqtt.py --debug \
+PYTHONPATH=src python -m tinkerforge_mqtt --debug \
  --show-payload \
  --global-topic-prefix $BALENA_DEVICE_UUID \
  --broker-host $BROKER_HOST \
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Callback throughput benchmark. The Brick Daemon emulator runs as a separate
+process with N devices that each send one callback at M Hz. The bindings run
+in this process, connected to the emulator, with the callback registered on
+all devices. By default messages are published to a local sink, with
+--mqtt-broker the paho client of the bindings publishes to a real broker.
+
+For every combination of device count and rate the result reports the
+offered rate (N * M), the rate at which callback packets arrived and the
+rate at which they were published. The latency of every published callback
+is split into the stages of the callback path:
+
+- receive: socket recv returned until IPConnection.handle_response
+- queue: handle_response until dispatch_packet in the Callback-Processor
+  thread, i.e. the time spent in the callback queue
+- decode: dispatch_packet until MQTTBindings.callback_function, unpacking
+  the payload
+- json: callback_function until MQTTBindings.publish, translating symbols
+  and encoding JSON
+- publish: MQTTBindings.publish until it returns, including the publish
+  call of the paho client
+
+The stages are measured by wrapping these functions on the instances, which
+adds a small constant overhead per callback.
+"""
+
+import sys
+import os
+import time
+import json
+import signal
+import socket
+import argparse
+import platform
+import threading
+import subprocess
+
+import harness
+from harness import tinkerforge_mqtt as tm
+from mqtt_test_broker import MQTTTestBroker
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+STAGES = ['receive', 'queue', 'decode', 'json', 'publish', 'total']
+
+def parse_int_list(value):
+    return [int(x) for x in value.split(',')]
+
+def parse_float_list(value):
+    return [float(x) for x in value.split(',')]
+
+class SocketProxy(object):
+    # records when recv returned, everything else is passed to the socket
+    def __init__(self, sock, tracer):
+        self.sock = sock
+        self.tracer = tracer
+
+    def recv(self, size):
+        data = self.sock.recv(size)
+        self.tracer.recv_time = time.time()
+
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+class StageTracer(object):
+    """
+    Wraps the functions of the callback path of one bindings instance and
+    collects per-stage timings of the callbacks with the given function ID.
+    """
+
+    def __init__(self, bindings, function_id):
+        self.bindings = bindings
+        self.function_id = function_id
+        self.measuring = False
+        self.lock = threading.Lock()
+        self.recv_time = None # only used by the receive thread
+        self.enqueued = {} # id(packet) -> (recv time, handle_response time), protected by lock
+        self.current = None # timestamps of the callback being dispatched, only used by the callback thread
+        self.arrived = 0 # protected by lock
+        self.published = 0 # protected by lock
+        self.stages = dict((stage, []) for stage in STAGES) # protected by lock
+
+    def install(self):
+        ipcon = self.bindings.ipcon
+        handle_response = ipcon.handle_response
+        dispatch_packet = ipcon.dispatch_packet
+        callback_function = self.bindings.callback_function
+        bindings_publish = self.bindings.publish
+
+        def traced_handle_response(packet):
+            if self.measuring and tm.get_sequence_number_from_data(packet) == 0 and \
+               tm.get_function_id_from_data(packet) == self.function_id:
+                with self.lock:
+                    self.arrived += 1
+                    self.enqueued[id(packet)] = (self.recv_time, time.time())
+
+            handle_response(packet)
+
+        def traced_dispatch_packet(packet):
+            with self.lock:
+                stamps = self.enqueued.pop(id(packet), None)
+
+            if stamps is not None and stamps[0] is not None:
+                self.current = [stamps[0], stamps[1], time.time()]
+
+            try:
+                dispatch_packet(packet)
+            finally:
+                self.current = None
+
+        def traced_callback_function(*args):
+            if self.current is not None and len(self.current) == 3:
+                self.current.append(time.time())
+
+            callback_function(*args)
+
+        def traced_bindings_publish(topic, payload, retain=False):
+            current = self.current
+
+            if current is not None and len(current) == 4:
+                current.append(time.time())
+                bindings_publish(topic, payload, retain)
+                self.record(current + [time.time()])
+            else:
+                bindings_publish(topic, payload, retain)
+
+        ipcon.handle_response = traced_handle_response
+        ipcon.dispatch_packet = traced_dispatch_packet
+        self.bindings.callback_function = traced_callback_function
+        self.bindings.publish = traced_bindings_publish
+
+        ipcon.socket = SocketProxy(ipcon.socket, self)
+
+    def record(self, timestamps):
+        received, handled, dispatched, decoded, encoded, published = timestamps
+
+        with self.lock:
+            self.published += 1
+            self.stages['receive'].append(handled - received)
+            self.stages['queue'].append(dispatched - handled)
+            self.stages['decode'].append(decoded - dispatched)
+            self.stages['json'].append(encoded - decoded)
+            self.stages['publish'].append(published - encoded)
+            self.stages['total'].append(published - received)
+
+    def start(self):
+        with self.lock:
+            self.enqueued = {}
+            self.arrived = 0
+            self.published = 0
+            self.stages = dict((stage, []) for stage in STAGES)
+
+        self.measuring = True
+
+    def stop(self):
+        self.measuring = False
+
+def start_emulator(port, device_count, device_type, uid_offset, callback_name, rate, seed):
+    args = [sys.executable, os.path.join(TOOLS_DIR, 'brickd_emulator.py'), '--port', str(port),
+            '--devices', str(device_count), '--device-type', device_type, '--uid-offset', str(uid_offset),
+            '--callback', callback_name, '--callback-rate', str(rate)]
+
+    if seed is not None:
+        args += ['--seed', str(seed)]
+
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=open(os.devnull, 'w'))
+    deadline = time.time() + 10
+
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('localhost', port), 0.5).close()
+            return process
+        except socket.error:
+            time.sleep(0.05)
+
+    process.kill()
+
+    raise Exception('Brick Daemon emulator did not start')
+
+def stop_emulator(process):
+    # the emulator prints its counters as JSON on SIGINT
+    process.send_signal(signal.SIGINT)
+    output = process.communicate()[0].decode('utf-8').strip().split('\n')
+
+    try:
+        return json.loads(output[-1])
+    except ValueError:
+        return None
+
+def run_case(args, broker, device_count, rate):
+    port = harness.get_free_port()
+    emulator = start_emulator(port, device_count, args.device_type, args.uid_offset, args.callback, rate, args.seed)
+    bindings, sink = harness.create_bindings(verbose=args.verbose)
+
+    if broker is not None:
+        del bindings.mqttc.publish # use the paho client instead of the sink
+        bindings.was_connected = False
+        bindings.connect_to_broker(broker[0], broker[1])
+
+    try:
+        bindings.connect_to_brickd('localhost', port, '')
+
+        device_class = tm.devices[args.device_type]
+        callback_info = device_class.callbacks[args.callback]
+        tracer = StageTracer(bindings, callback_info.id)
+        tracer.install()
+
+        for i in range(device_count):
+            uid = tm.base58encode(args.uid_offset + i)
+            harness.send_message(bindings, 'register/{0}/{1}/{2}'.format(args.device_type, uid, args.callback), 'true')
+
+        time.sleep(args.warmup)
+
+        max_queue_depth = 0
+        tracer.start()
+        start = time.time()
+
+        while time.time() - start < args.duration:
+            time.sleep(0.05)
+            callback = bindings.ipcon.callback
+
+            if callback is not None:
+                max_queue_depth = max(max_queue_depth, callback.queue.qsize())
+
+        tracer.stop()
+        elapsed = time.time() - start
+    finally:
+        bindings.ipcon.disconnect()
+
+        if broker is not None:
+            bindings.mqttc.loop_stop()
+            bindings.mqttc.disconnect()
+
+        emulator_counters = stop_emulator(emulator)
+
+    with tracer.lock:
+        arrived = tracer.arrived
+        published = tracer.published
+        stages = dict((stage, harness.summarize_latencies(values)) for stage, values in tracer.stages.items())
+
+    offered = device_count * rate
+
+    return {
+        'devices': device_count,
+        'rate': rate,
+        'offered_rate': offered,
+        'arrived_rate': round(arrived / elapsed, 1),
+        'published_rate': round(published / elapsed, 1),
+        'published_ratio': round(published / (offered * elapsed), 3) if offered > 0 else None,
+        'max_queue_depth': max_queue_depth,
+        'latency_ms': stages,
+        'emulator': emulator_counters
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Callback throughput benchmark of the MQTT bindings')
+    parser.add_argument('--devices', type=parse_int_list, default=[1, 10, 50],
+                        help='comma separated device counts (default: 1,10,50)')
+    parser.add_argument('--rates', type=parse_float_list, default=[10, 100],
+                        help='comma separated callback rates per device in Hz (default: 10,100)')
+    parser.add_argument('--device-type', default='temperature_v2_bricklet',
+                        help='MQTT name of the device type (default: temperature_v2_bricklet)')
+    parser.add_argument('--callback', default='temperature', help='callback to register (default: temperature)')
+    parser.add_argument('--uid-offset', type=int, default=10000, help='numeric UID of the first device (default: 10000)')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds to measure per case (default: 5.0)')
+    parser.add_argument('--warmup', type=float, default=1.0, help='seconds before measuring (default: 1.0)')
+    parser.add_argument('--mqtt-broker', default=None,
+                        help='publish to this broker as HOST:PORT or "built-in", instead of a local sink')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the random values')
+    parser.add_argument('--output', default=None, help='write the JSON result to this file instead of stdout')
+    parser.add_argument('--verbose', action='store_true', help='show the log output of the bindings')
+
+    args = parser.parse_args()
+
+    if args.device_type not in tm.devices:
+        parser.error('unknown device type {0}'.format(args.device_type))
+
+    callback_info = tm.devices[args.device_type].callbacks.get(args.callback)
+
+    if callback_info is None or callback_info.high_level_info is not None:
+        parser.error('{0} has no low-level callback {1}'.format(args.device_type, args.callback))
+
+    test_broker = None
+    broker = None
+
+    if args.mqtt_broker == 'built-in':
+        test_broker = MQTTTestBroker('localhost', 0)
+        test_broker.start()
+        broker = ('localhost', test_broker.port)
+    elif args.mqtt_broker is not None:
+        host, port = args.mqtt_broker.rsplit(':', 1)
+        broker = (host, int(port))
+
+    cases = []
+
+    try:
+        for device_count in args.devices:
+            for rate in args.rates:
+                cases.append(run_case(args, broker, device_count, rate))
+    finally:
+        if test_broker is not None:
+            test_broker.stop()
+
+    result = {
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'device_type': args.device_type,
+        'callback': args.callback,
+        'duration': args.duration,
+        'publish_target': args.mqtt_broker or 'sink',
+        'cases': cases
+    }
+
+    output = json.dumps(result, indent=2, sort_keys=True)
+
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
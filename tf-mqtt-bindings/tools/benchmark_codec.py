@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmark of the payload codec over the whole protocol surface. All
+distinct payload formats are collected from the devices registry: request
+payloads (payload_fmt), responses (response_fmt) and callbacks. For each
+format random valid values are generated and the following steps are timed
+in nanoseconds per call:
+
+- pack: pack_payload
+- unpack: unpack_payload
+- validate: what device_call does with a request before sending it, parsing
+  the JSON arguments and MQTTBindings.parse_call_args (request payloads only)
+- json: translating symbols and encoding the result as JSON, with
+  MQTTBindings.format_call_response for responses and like callback_function
+  for callbacks (responses and callbacks only)
+
+Each format is measured with the first function or callback that uses it, in
+sorted order, so results of different runs are comparable. With --baseline
+the result of an earlier run is compared per format.
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+
+import harness
+from harness import tinkerforge_mqtt as tm
+
+KIND_REQUEST = 'request'
+KIND_RESPONSE = 'response'
+KIND_CALLBACK = 'callback'
+
+def collect_formats():
+    # (kind, format) -> [usages, device name, function name, info]
+    formats = {}
+
+    def add(kind, fmt, device_name, name, info):
+        key = (kind, fmt)
+
+        if key in formats:
+            formats[key][0] += 1
+        else:
+            formats[key] = [1, device_name, name, info]
+
+    for device_name in sorted(tm.devices):
+        device_class = tm.devices[device_name]
+
+        for name in sorted(device_class.functions):
+            info = device_class.functions[name]
+
+            if not isinstance(info, tm.FunctionInfo):
+                continue # high-level functions consist of low-level calls
+
+            if len(info.payload_fmt) > 0:
+                add(KIND_REQUEST, info.payload_fmt, device_name, name, info)
+
+            if len(info.response_fmt) > 0:
+                add(KIND_RESPONSE, info.response_fmt, device_name, name, info)
+
+        for name in sorted(device_class.callbacks):
+            info = device_class.callbacks[name]
+
+            if len(info.fmt[1]) > 0:
+                add(KIND_CALLBACK, info.fmt[1], device_name, name, info)
+
+    return formats
+
+def to_json_value(value):
+    return list(value) if isinstance(value, tuple) else value
+
+def time_call(function, samples, iterations):
+    # nanoseconds per call, best of three rounds
+    best = None
+
+    for _ in range(3):
+        start = time.perf_counter()
+
+        for _ in range(iterations):
+            for sample in samples:
+                function(sample)
+
+        elapsed = (time.perf_counter() - start) / (iterations * len(samples))
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return round(best * 1e9, 1)
+
+def measure(bindings, kind, fmt, device_name, name, info, samples, iterations):
+    packed = [tm.pack_payload(values, fmt) for values in samples]
+    result = {
+        'size': len(packed[0]),
+        'pack_ns': time_call(lambda values: tm.pack_payload(values, fmt), samples, iterations),
+        'unpack_ns': time_call(lambda data: tm.unpack_payload(data, fmt), packed, iterations)
+    }
+
+    if kind == KIND_REQUEST:
+        requests = [json.dumps(dict(zip(info.arg_names, [to_json_value(value) for value in values]))) for values in samples]
+
+        def validate(request):
+            _, error = bindings.parse_call_args(device_name, '1', name, info, json.loads(request))
+
+            if error is not None:
+                raise Exception(error)
+
+        validate(requests[0]) # the generated values must pass
+        result['validate_ns'] = time_call(validate, requests, iterations)
+    elif kind == KIND_RESPONSE:
+        # unpack_payload returns a single value as is, like send_request
+        unpacked = [tm.unpack_payload(data, fmt) for data in packed]
+
+        if 'device_identifier' in info.result_names:
+            # get_identity looks up the name of the device identifier, it has to exist
+            index = info.result_names.index('device_identifier')
+            unpacked = [tuple(values[:index]) + (tm.device_definitions[device_name][1],) + tuple(values[index + 1:]) for values in unpacked]
+
+        def encode(values):
+            return json.dumps(bindings.format_call_response(name, info, values))
+
+        result['json_ns'] = time_call(encode, unpacked, iterations)
+    else:
+        # callbacks get the unpacked values as arguments, like callback_function
+        unpacked = [tm.unpack_payload(data, fmt) for data in packed]
+
+        if len(info.names) == 1:
+            unpacked = [(values,) for values in unpacked]
+
+        def encode(values):
+            return json.dumps(dict(zip(info.names, bindings.translate_symbols(info.symbols, values))))
+
+        result['json_ns'] = time_call(encode, unpacked, iterations)
+
+    return result
+
+def compare(entries, baseline):
+    # adds the ratio to the baseline per step and returns the geometric mean
+    # ratio per step over all formats present in both runs
+    previous = dict(((entry['kind'], entry['format']), entry) for entry in baseline.get('formats', []))
+    logs = {}
+
+    for entry in entries:
+        old = previous.get((entry['kind'], entry['format']))
+
+        if old is None:
+            continue
+
+        for step in ['pack_ns', 'unpack_ns', 'validate_ns', 'json_ns']:
+            if step in entry and old.get(step):
+                ratio = entry[step] / old[step]
+                entry.setdefault('ratio', {})[step] = round(ratio, 3)
+                logs.setdefault(step, []).append(ratio)
+
+    summary = {}
+
+    for step, ratios in logs.items():
+        product = 1.0
+
+        for ratio in ratios:
+            product *= ratio ** (1.0 / len(ratios))
+
+        summary[step] = round(product, 3)
+
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmark of the payload codec over all payload formats')
+    parser.add_argument('--samples', type=int, default=20, help='random payloads per format (default: 20)')
+    parser.add_argument('--iterations', type=int, default=50, help='passes over the payloads per round (default: 50)')
+    parser.add_argument('--filter', default=None, help='only measure formats matching this regular expression')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random payloads (default: 0)')
+    parser.add_argument('--baseline', default=None, help='JSON result of an earlier run to compare with')
+    parser.add_argument('--output', default=None, help='write the JSON result to this file instead of stdout')
+
+    args = parser.parse_args()
+
+    bindings, _ = harness.create_bindings()
+    rng = random.Random(args.seed)
+    pattern = re.compile(args.filter) if args.filter is not None else None
+    formats = collect_formats()
+    entries = []
+
+    for kind, fmt in sorted(formats):
+        if pattern is not None and not pattern.search(fmt):
+            continue
+
+        usages, device_name, name, info = formats[(kind, fmt)]
+        samples = [harness.random_values(fmt, rng) for _ in range(args.samples)]
+        entry = {
+            'kind': kind,
+            'format': fmt,
+            'usages': usages,
+            'example': '{0}.{1}'.format(device_name, name)
+        }
+        entry.update(measure(bindings, kind, fmt, device_name, name, info, samples, args.iterations))
+        entries.append(entry)
+
+    totals = {}
+
+    for entry in entries:
+        for step in ['pack_ns', 'unpack_ns', 'validate_ns', 'json_ns']:
+            if step in entry:
+                # weighted by the number of functions and callbacks using the format
+                totals[step] = round(totals.get(step, 0) + entry[step] * entry['usages'], 1)
+
+    result = {
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'samples': args.samples,
+        'iterations': args.iterations,
+        'seed': args.seed,
+        'format_count': len(entries),
+        'weighted_totals_ns': totals,
+        'formats': entries
+    }
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            result['baseline_ratio'] = compare(entries, json.load(f))
+
+    output = json.dumps(result, indent=2, sort_keys=True)
+
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
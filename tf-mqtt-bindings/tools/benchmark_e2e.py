@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+End-to-end benchmark of the request path: an MQTT request is sent to the
+bindings, forwarded to the Brick Daemon emulator and answered with an MQTT
+response. The bindings run as a separate process, exactly as they are
+deployed. The Brick Daemon emulator and (unless an external broker is given)
+a minimal MQTT broker run in this process.
+
+For every combination of device count and payload size the bindings are
+started once, then each concurrency level runs for a fixed time. Every
+worker sends one request at a time and waits for its response (closed loop),
+cycling through all devices. The payload size selects the zero-argument
+getter whose response payload is closest to it. Latency percentiles and the
+achieved rate are reported per concurrency level, the maximum sustainable
+rate is the highest rate reached without errors or timeouts.
+
+The result is written as JSON, to compare versions before a rollout.
+"""
+
+import sys
+import os
+import time
+import json
+import random
+import logging
+import argparse
+import platform
+import threading
+import subprocess
+
+import paho.mqtt.client as mqtt
+
+import harness
+from harness import tinkerforge_mqtt as tm
+from brickd_emulator import BrickdEmulator, create_devices
+from mqtt_test_broker import MQTTTestBroker
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+GLOBAL_PREFIX = 'benchmark/'
+
+logger = logging.getLogger('End-to-end benchmark')
+
+def parse_int_list(value):
+    return [int(x) for x in value.split(',')]
+
+def select_getter(payload_size):
+    # zero-argument getter of any device type with the response payload closest
+    # to payload_size, as (device name, function name, response payload size)
+    best = None
+
+    for device_name in sorted(tm.devices):
+        device_class = tm.devices[device_name]
+
+        for function_name in sorted(device_class.functions):
+            info = device_class.functions[function_name]
+
+            if not isinstance(info, tm.FunctionInfo) or not function_name.startswith('get_') or len(info.arg_names) > 0 \
+               or len(info.result_names) == 0:
+                continue
+
+            size = info.response_size - 8
+            distance = abs(size - payload_size)
+
+            if best is None or distance < best[0]:
+                best = (distance, device_name, function_name, size)
+
+    return best[1:]
+
+def get_bindings_version():
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+
+    try:
+        output = subprocess.check_output([sys.executable, '-m', 'tinkerforge_mqtt', '--version'], env=env, stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return output.decode('utf-8').strip().split(' ')[-1]
+
+class ResponseWaiter(object):
+    """
+    MQTT client that sends requests and waits for the matching response. Each
+    worker uses its own topic suffix, so responses can't be confused.
+    """
+
+    def __init__(self, host, port):
+        self.lock = threading.Lock()
+        self.pending = {} # response topic -> [event, payload], protected by lock
+        self.connected = threading.Event()
+        self.mqttc = mqtt.Client(client_id='tinkerforge-benchmark-{0}'.format(os.getpid()))
+        self.mqttc.on_connect = self.on_connect
+        self.mqttc.on_message = self.on_message
+        self.mqttc.connect(host, port)
+        self.mqttc.loop_start()
+
+        if not self.connected.wait(10):
+            raise Exception('Could not connect to MQTT broker {0}:{1}'.format(host, port))
+
+    def on_connect(self, mqttc, userdata, flags, rc):
+        mqttc.subscribe(GLOBAL_PREFIX + 'response/#')
+        self.connected.set()
+
+    def on_message(self, mqttc, userdata, msg):
+        with self.lock:
+            entry = self.pending.get(msg.topic)
+
+        if entry is not None:
+            entry[1] = msg.payload
+            entry[0].set()
+
+    def request(self, topic, payload, timeout):
+        # topic is relative to the global prefix. returns the decoded response
+        # or None on timeout
+        response_topic = GLOBAL_PREFIX + 'response/' + topic.split('/', 1)[1]
+        entry = [threading.Event(), None]
+
+        with self.lock:
+            self.pending[response_topic] = entry
+
+        self.mqttc.publish(GLOBAL_PREFIX + topic, payload)
+        received = entry[0].wait(timeout)
+
+        with self.lock:
+            self.pending.pop(response_topic, None)
+
+        if not received:
+            return None
+
+        return json.loads(entry[1].decode('utf-8'))
+
+    def close(self):
+        self.mqttc.loop_stop()
+        self.mqttc.disconnect()
+
+def start_bindings(broker_host, broker_port, ipcon_port, verbose, extra_args=()):
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    args = [sys.executable, '-m', 'tinkerforge_mqtt',
+            '--broker-host', broker_host, '--broker-port', str(broker_port),
+            '--ipcon-host', 'localhost', '--ipcon-port', str(ipcon_port),
+            '--global-topic-prefix', GLOBAL_PREFIX, '--no-init-file', '--no-registration-file'] + list(extra_args)
+    output = None if verbose else open(os.devnull, 'w')
+
+    return subprocess.Popen(args, env=env, stdout=output, stderr=output)
+
+def wait_for_connection(waiter, timeout):
+    deadline = time.time() + timeout
+
+    while time.time() < deadline:
+        response = waiter.request('request/ip_connection/get_connection_state', '', 1.0)
+
+        if response is not None and response.get('connection_state') == 'connected':
+            return True
+
+        time.sleep(0.1)
+
+    return False
+
+def run_level(waiter, topics, concurrency, duration, timeout):
+    lock = threading.Lock()
+    latencies = []
+    counts = {'requests': 0, 'errors': 0, 'timeouts': 0}
+    deadline = time.time() + duration
+
+    def worker(index):
+        own_latencies = []
+        own_counts = {'requests': 0, 'errors': 0, 'timeouts': 0}
+        position = index
+
+        while time.time() < deadline:
+            topic = topics[position % len(topics)] + '/w{0}'.format(index)
+            position += 1
+            start = time.time()
+            response = waiter.request(topic, '', timeout)
+            own_counts['requests'] += 1
+
+            if response is None:
+                own_counts['timeouts'] += 1
+            elif '_ERROR' in response:
+                own_counts['errors'] += 1
+            else:
+                own_latencies.append(time.time() - start)
+
+        with lock:
+            latencies.extend(own_latencies)
+
+            for key, value in own_counts.items():
+                counts[key] += value
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start = time.time()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.time() - start
+    result = dict(counts)
+    result['concurrency'] = concurrency
+    result['rate'] = round(len(latencies) / elapsed, 1) if elapsed > 0 else None
+    result['latency_ms'] = harness.summarize_latencies(latencies)
+
+    return result
+
+def run_case(args, broker_host, broker_port, device_count, payload_size):
+    device_name, function_name, response_size = select_getter(payload_size)
+    rng = random.Random(args.seed)
+    devices = create_devices(device_count, [device_name], rng=rng)
+    emulator = BrickdEmulator(devices, 'localhost', 0, latency=args.latency / 1000, seed=args.seed)
+    emulator.start()
+
+    process = start_bindings(broker_host, broker_port, emulator.port, args.verbose)
+    waiter = None
+
+    try:
+        waiter = ResponseWaiter(broker_host, broker_port)
+
+        if not wait_for_connection(waiter, args.startup_timeout):
+            raise Exception('Bindings did not connect to the Brick Daemon emulator')
+
+        topics = ['request/{0}/{1}/{2}'.format(device_name, device.uid, function_name) for device in devices]
+
+        # the first call of each device checks its identity, keep that out of the measurement
+        for topic in topics:
+            waiter.request(topic + '/warmup', '', args.timeout)
+
+        levels = [run_level(waiter, topics, concurrency, args.duration, args.timeout) for concurrency in args.concurrency]
+    finally:
+        if waiter is not None:
+            waiter.close()
+
+        process.terminate()
+        process.wait()
+        emulator.stop()
+
+    sustainable = [level['rate'] for level in levels if level['errors'] == 0 and level['timeouts'] == 0 and level['rate'] is not None]
+
+    return {
+        'devices': device_count,
+        'payload_size': payload_size,
+        'device_type': device_name,
+        'function': function_name,
+        'response_payload_size': response_size,
+        'levels': levels,
+        'max_sustainable_rate': max(sustainable) if len(sustainable) > 0 else None
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end request/response benchmark of the MQTT bindings')
+    parser.add_argument('--devices', type=parse_int_list, default=[1, 10, 50],
+                        help='comma separated device counts (default: 1,10,50)')
+    parser.add_argument('--payload-sizes', type=parse_int_list, default=[1, 16, 60],
+                        help='comma separated response payload sizes in bytes (default: 1,16,60)')
+    parser.add_argument('--concurrency', type=parse_int_list, default=[1, 4, 16],
+                        help='comma separated numbers of concurrent requesters (default: 1,4,16)')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per concurrency level (default: 5.0)')
+    parser.add_argument('--timeout', type=float, default=5.0, help='seconds to wait for a response (default: 5.0)')
+    parser.add_argument('--startup-timeout', type=float, default=30.0,
+                        help='seconds to wait for the bindings to connect (default: 30.0)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='latency in milliseconds added by the Brick Daemon emulator (default: 0)')
+    parser.add_argument('--broker-host', default=None, help='use this MQTT broker instead of the built-in one')
+    parser.add_argument('--broker-port', type=int, default=1883, help='port of the external MQTT broker (default: 1883)')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the random values')
+    parser.add_argument('--output', default=None, help='write the JSON result to this file instead of stdout')
+    parser.add_argument('--verbose', action='store_true', help='show the output of the bindings')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger().setLevel(logging.INFO) # harness lowers the level for the bindings
+
+    broker = None
+
+    if args.broker_host is None:
+        broker = MQTTTestBroker('localhost', 0)
+        broker.start()
+        broker_host, broker_port = 'localhost', broker.port
+    else:
+        broker_host, broker_port = args.broker_host, args.broker_port
+
+    cases = []
+
+    try:
+        for device_count in args.devices:
+            for payload_size in args.payload_sizes:
+                logger.info('Running {0} device(s), payload size {1}'.format(device_count, payload_size))
+                cases.append(run_case(args, broker_host, broker_port, device_count, payload_size))
+    finally:
+        if broker is not None:
+            broker.stop()
+
+    result = {
+        'bindings_version': get_bindings_version(),
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'broker': 'built-in' if broker is not None else '{0}:{1}'.format(broker_host, broker_port),
+        'duration': args.duration,
+        'emulator_latency_ms': args.latency,
+        'cases': cases
+    }
+
+    output = json.dumps(result, indent=2, sort_keys=True)
+
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
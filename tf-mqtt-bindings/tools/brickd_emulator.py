@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Brick Daemon emulator with virtual Bricklets for load tests without hardware.
+It speaks the TFP protocol over TCP the way IPConnection expects it:
+
+- enumerate requests are answered with one enumerate callback per device
+- get_identity reports the configured device type
+- the disconnect probe is accepted
+- authentication works like in Brick Daemon if a secret is configured
+- all other functions are answered from the function tables of the bindings,
+  getters return the values of the matching setter or random values
+- low-level callbacks of all devices are sent at a configurable rate
+
+Latency, jitter, packet loss and periodic disconnects can be injected. The
+emulator can be used from the command line or as a module, see BrickdEmulator.
+"""
+
+import sys
+import os
+import time
+import json
+import heapq
+import hmac
+import socket
+import struct
+import random
+import hashlib
+import logging
+import argparse
+import threading
+
+import harness
+from harness import tinkerforge_mqtt as tm
+
+BRICK_DAEMON_UID = 1 # base58 '2'
+FUNCTION_DISCONNECT_PROBE = tm.IPConnection.FUNCTION_DISCONNECT_PROBE
+FUNCTION_ENUMERATE = tm.IPConnection.FUNCTION_ENUMERATE
+FUNCTION_GET_IDENTITY = 255
+CALLBACK_ENUMERATE = tm.IPConnection.CALLBACK_ENUMERATE
+ENUMERATE_FORMAT = '8s 8s c 3B 3B H B'
+IDENTITY_FORMAT = '8s 8s c 3B 3B H'
+ERROR_CODE_NOT_SUPPORTED = 2
+
+logger = logging.getLogger('Brick Daemon emulator')
+
+class VirtualDevice(object):
+    """
+    A simulated Brick or Bricklet of one of the device types of the bindings.
+    Setter arguments are kept as state and returned by the matching getter.
+    """
+
+    def __init__(self, uid, device_name, position='a', rng=None):
+        self.uid = uid
+        self.uid_int = tm.base58decode(uid)
+        self.device_name = device_name
+        self.device_class = tm.devices[device_name]
+        self.device_identifier = tm.device_definitions[device_name][1]
+        self.position = position
+        self.rng = rng or random.Random()
+        self.lock = threading.Lock()
+        self.state = {} # setter name without 'set_' -> arguments, protected by lock
+        self.functions = {} # function ID -> (name, FunctionInfo)
+        self.callbacks = [] # (callback name, CallbackInfo) of the low-level callbacks
+
+        for name, info in self.device_class.functions.items():
+            if isinstance(info, tm.FunctionInfo):
+                self.functions[info.id] = (name, info)
+
+        for name, info in self.device_class.callbacks.items():
+            if info.high_level_info is None:
+                self.callbacks.append((name, info))
+
+    def get_identity(self):
+        return (self.uid, '0', self.position, (1, 0, 0), (2, 0, 0), self.device_identifier)
+
+    def call(self, function_id, payload):
+        # returns (error code, response payload)
+        if function_id == FUNCTION_GET_IDENTITY:
+            return 0, tm.pack_payload(self.get_identity(), IDENTITY_FORMAT)
+
+        entry = self.functions.get(function_id)
+
+        if entry is None:
+            return ERROR_CODE_NOT_SUPPORTED, b''
+
+        name, info = entry
+
+        if name.startswith('set_') and len(info.payload_fmt) > 0:
+            try:
+                args = tm.unpack_payload(payload, info.payload_fmt)
+            except struct.error:
+                return 1, b'' # invalid parameter
+
+            with self.lock:
+                self.state[name[4:]] = args if len(info.arg_names) > 1 else [args]
+
+        if len(info.response_fmt) == 0:
+            return 0, b''
+
+        values = None
+
+        if name.startswith('get_'):
+            with self.lock:
+                values = self.state.get(name[4:])
+
+        if values is not None and len(values) == len(info.result_names):
+            try:
+                return 0, tm.pack_payload(values, info.response_fmt)
+            except Exception:
+                pass # the setter has different arguments
+
+        return 0, tm.pack_payload(harness.random_values(info.response_fmt, self.rng), info.response_fmt)
+
+    def create_callback_payload(self, info):
+        return tm.pack_payload(harness.random_values(info.fmt[1], self.rng), info.fmt[1])
+
+class ClientConnection(object):
+    """
+    One client of the emulator. Received packets are handled by a reader
+    thread, outgoing packets are scheduled according to the injected latency
+    and sent by a sender thread.
+    """
+
+    def __init__(self, emulator, sock, address):
+        self.emulator = emulator
+        self.socket = sock
+        self.address = address
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.outgoing = [] # heap of (send time, sequence, data), protected by lock
+        self.sequence = 0 # protected by lock
+        self.closed = False # protected by lock
+        self.authenticated = emulator.auth_secret is None
+        self.server_nonce = None
+
+    def start(self):
+        for name, target in [('Emulator-Reader', self.read_loop), ('Emulator-Sender', self.send_loop)]:
+            thread = threading.Thread(name=name, target=target)
+            thread.daemon = True
+            thread.start()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+
+            self.closed = True
+            self.condition.notify_all()
+
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+        self.socket.close()
+        self.emulator.remove_client(self)
+
+    def queue(self, data, delay=None):
+        emulator = self.emulator
+
+        if emulator.loss > 0 and emulator.rng.random() < emulator.loss:
+            emulator.count('dropped')
+            return
+
+        if delay == None:
+            delay = emulator.latency + (emulator.rng.random() * emulator.jitter if emulator.jitter > 0 else 0)
+
+        with self.lock:
+            if self.closed:
+                return
+
+            self.sequence += 1
+            heapq.heappush(self.outgoing, (time.time() + delay, self.sequence, data))
+            self.condition.notify()
+
+    def send_loop(self):
+        while True:
+            with self.lock:
+                while not self.closed and (len(self.outgoing) == 0 or self.outgoing[0][0] > time.time()):
+                    self.condition.wait(self.outgoing[0][0] - time.time() if len(self.outgoing) > 0 else None)
+
+                if self.closed:
+                    return
+
+                # send everything that is due in one write
+                packets = []
+
+                while len(self.outgoing) > 0 and self.outgoing[0][0] <= time.time():
+                    packets.append(heapq.heappop(self.outgoing)[2])
+
+            try:
+                self.socket.sendall(b''.join(packets))
+            except socket.error:
+                self.close()
+                return
+
+    def read_loop(self):
+        pending = b''
+
+        while True:
+            try:
+                data = self.socket.recv(8192)
+            except socket.error:
+                data = b''
+
+            if len(data) == 0:
+                self.close()
+                return
+
+            pending += data
+
+            while len(pending) >= 8:
+                length = tm.get_length_from_data(pending)
+
+                if length < 8:
+                    self.close() # out of sync
+                    return
+
+                if len(pending) < length:
+                    break
+
+                packet = pending[:length]
+                pending = pending[length:]
+                self.handle_packet(packet)
+
+    def respond(self, request, error_code, payload):
+        uid, _, function_id, sequence_and_flags, _ = struct.unpack('<IBBBB', request[:8])
+        header = struct.pack('<IBBBB', uid, 8 + len(payload), function_id, sequence_and_flags, error_code << 6)
+
+        self.queue(header + payload)
+        self.emulator.count('responses')
+
+    def handle_packet(self, packet):
+        uid, _, function_id, sequence_and_flags, _ = struct.unpack('<IBBBB', packet[:8])
+        response_expected = (sequence_and_flags & 0x08) != 0
+        emulator = self.emulator
+
+        emulator.count('requests')
+
+        if uid == BRICK_DAEMON_UID:
+            self.handle_brick_daemon_packet(packet, function_id, response_expected)
+            return
+
+        if not self.authenticated:
+            return # Brick Daemon ignores everything else until the authentication succeeded
+
+        if function_id == FUNCTION_DISCONNECT_PROBE and uid == 0:
+            return
+
+        if function_id == FUNCTION_ENUMERATE and uid == 0:
+            for device in emulator.get_devices():
+                payload = tm.pack_payload(device.get_identity() + (tm.IPConnection.ENUMERATION_TYPE_AVAILABLE,), ENUMERATE_FORMAT)
+                self.queue(struct.pack('<IBBBB', device.uid_int, 8 + len(payload), CALLBACK_ENUMERATE, 0, 0) + payload)
+
+            return
+
+        device = emulator.get_device(uid)
+
+        if device is None:
+            return # like a real Brick Daemon, requests to unknown UIDs time out
+
+        error_code, payload = device.call(function_id, packet[8:])
+
+        if response_expected or len(payload) > 0:
+            self.respond(packet, error_code, payload)
+
+    def handle_brick_daemon_packet(self, packet, function_id, response_expected):
+        secret = self.emulator.auth_secret
+
+        if function_id == tm.BrickDaemon.FUNCTION_GET_AUTHENTICATION_NONCE:
+            self.server_nonce = os.urandom(4)
+            self.respond(packet, 0, self.server_nonce)
+        elif function_id == tm.BrickDaemon.FUNCTION_AUTHENTICATE:
+            if secret is None or self.server_nonce is None:
+                self.close() # authentication is not enabled, Brick Daemon disconnects
+                return
+
+            client_nonce = packet[8:12]
+            digest = packet[12:32]
+            expected = hmac.new(secret.encode('ascii'), self.server_nonce + client_nonce, hashlib.sha1).digest()
+
+            if not hmac.compare_digest(digest, expected):
+                self.close()
+                return
+
+            self.authenticated = True
+
+            if response_expected:
+                self.respond(packet, 0, b'')
+        elif response_expected:
+            self.respond(packet, ERROR_CODE_NOT_SUPPORTED, b'')
+
+class BrickdEmulator(object):
+    """
+    TCP server that emulates Brick Daemon with the given VirtualDevices. The
+    fault injection attributes (latency, jitter, loss) can be changed while
+    the emulator is running.
+    """
+
+    def __init__(self, devices, host='localhost', port=4223, callback_rate=0.0, callback_names=None,
+                 latency=0.0, jitter=0.0, loss=0.0, disconnect_interval=0.0, auth_secret=None, seed=None):
+        self.host = host
+        self.port = port
+        self.callback_rate = callback_rate # per callback and device, in Hz
+        self.callback_names = callback_names # None sends all low-level callbacks
+        self.latency = latency # seconds
+        self.jitter = jitter # seconds
+        self.loss = loss # fraction of outgoing packets that is dropped
+        self.disconnect_interval = disconnect_interval # seconds, 0 disables
+        self.auth_secret = auth_secret
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.devices = dict((device.uid_int, device) for device in devices) # protected by lock
+        self.clients = [] # protected by lock
+        self.counters = {'requests': 0, 'responses': 0, 'callbacks': 0, 'dropped': 0, 'connections': 0} # protected by lock
+        self.server_socket = None
+        self.running = False
+
+    def start(self):
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(16)
+        self.port = self.server_socket.getsockname()[1] # if port 0 was requested
+        self.running = True
+
+        for name, target in [('Emulator-Acceptor', self.accept_loop),
+                             ('Emulator-Callbacks', self.callback_loop),
+                             ('Emulator-Disconnector', self.disconnect_loop)]:
+            thread = threading.Thread(name=name, target=target)
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        self.running = False
+
+        try:
+            self.server_socket.close()
+        except socket.error:
+            pass
+
+        self.disconnect_clients()
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def get_counters(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def get_devices(self):
+        with self.lock:
+            return list(self.devices.values())
+
+    def get_device(self, uid):
+        with self.lock:
+            return self.devices.get(uid)
+
+    def add_device(self, device):
+        with self.lock:
+            self.devices[device.uid_int] = device
+
+    def remove_device(self, uid):
+        with self.lock:
+            return self.devices.pop(tm.base58decode(uid), None)
+
+    def get_clients(self):
+        with self.lock:
+            return list(self.clients)
+
+    def remove_client(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def disconnect_clients(self):
+        for client in self.get_clients():
+            client.close()
+
+    def accept_loop(self):
+        while self.running:
+            try:
+                sock, address = self.server_socket.accept()
+            except socket.error:
+                return
+
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = ClientConnection(self, sock, address)
+
+            with self.lock:
+                self.clients.append(client)
+                self.counters['connections'] += 1
+
+            logger.debug('Client {0} connected'.format(address))
+            client.start()
+
+    def callback_loop(self):
+        next_time = time.time()
+
+        while self.running:
+            if self.callback_rate <= 0:
+                time.sleep(0.1)
+                next_time = time.time()
+                continue
+
+            next_time += 1.0 / self.callback_rate
+            delay = next_time - time.time()
+
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -1.0:
+                next_time = time.time() # too far behind, don't try to catch up
+
+            clients = [client for client in self.get_clients() if client.authenticated]
+
+            if len(clients) == 0:
+                continue
+
+            sent = 0
+
+            for device in self.get_devices():
+                for name, info in device.callbacks:
+                    if self.callback_names is not None and name not in self.callback_names:
+                        continue
+
+                    payload = device.create_callback_payload(info)
+                    packet = struct.pack('<IBBBB', device.uid_int, 8 + len(payload), info.id, 0, 0) + payload
+
+                    for client in clients:
+                        client.queue(packet)
+
+                    sent += 1
+
+            self.count('callbacks', sent)
+
+    def disconnect_loop(self):
+        while self.running:
+            if self.disconnect_interval <= 0:
+                time.sleep(0.5)
+                continue
+
+            time.sleep(self.disconnect_interval)
+            logger.debug('Injecting disconnect')
+            self.disconnect_clients()
+
+def create_devices(count, device_names, uid_offset=10000, rng=None):
+    """
+    Creates count VirtualDevices, cycling through the device names. UIDs are
+    numbered from uid_offset on.
+    """
+
+    rng = rng or random.Random()
+    positions = 'abcdefgh'
+
+    return [VirtualDevice(tm.base58encode(uid_offset + i), device_names[i % len(device_names)], positions[i % len(positions)], rng)
+            for i in range(count)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Brick Daemon emulator with virtual Bricklets')
+    parser.add_argument('--host', default='localhost', help='address to listen on (default: localhost)')
+    parser.add_argument('--port', type=int, default=4223, help='port to listen on (default: 4223)')
+    parser.add_argument('--devices', type=int, default=10, help='number of virtual devices (default: 10)')
+    parser.add_argument('--device-type', dest='device_types', action='append', default=None,
+                        help='MQTT name of the device type, can be given multiple times (default: temperature_v2_bricklet)')
+    parser.add_argument('--uid-offset', type=int, default=10000, help='numeric UID of the first device (default: 10000)')
+    parser.add_argument('--callback-rate', type=float, default=0.0,
+                        help='rate in Hz at which each low-level callback of each device is sent (default: 0, disabled)')
+    parser.add_argument('--callback', dest='callbacks', action='append', default=None,
+                        help='only send this callback, can be given multiple times (default: all low-level callbacks)')
+    parser.add_argument('--latency', type=float, default=0.0, help='added latency of every packet in milliseconds (default: 0)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random additional latency in milliseconds (default: 0)')
+    parser.add_argument('--loss', type=float, default=0.0, help='fraction of outgoing packets that is dropped (default: 0)')
+    parser.add_argument('--disconnect-interval', type=float, default=0.0,
+                        help='seconds between injected disconnects of all clients (default: 0, disabled)')
+    parser.add_argument('--auth-secret', default=None, help='require authentication with this secret')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the random values')
+    parser.add_argument('--debug', action='store_true', help='show debug output')
+
+    args = parser.parse_args()
+
+    logger.setLevel(logging.DEBUG if args.debug else logging.INFO)
+
+    device_types = args.device_types or ['temperature_v2_bricklet']
+
+    for device_type in device_types:
+        if device_type not in tm.devices:
+            parser.error('unknown device type {0}'.format(device_type))
+
+    rng = random.Random(args.seed)
+    emulator = BrickdEmulator(create_devices(args.devices, device_types, args.uid_offset, rng),
+                              args.host, args.port, args.callback_rate, args.callbacks,
+                              args.latency / 1000, args.jitter / 1000, args.loss, args.disconnect_interval,
+                              args.auth_secret, args.seed)
+    emulator.start()
+
+    logger.info('Emulating Brick Daemon with {0} device(s) on {1}:{2}'.format(args.devices, args.host, emulator.port))
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+
+    emulator.stop()
+    print(json.dumps(emulator.get_counters(), sort_keys=True))
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
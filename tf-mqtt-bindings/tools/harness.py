@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+"""
+Helpers shared by the replay, benchmark and soak test tools. They run the
+bindings without an MQTT broker, messages are published to a PublishSink
+instead.
+"""
+
+import os
+import sys
+import time
+import random
+import socket
+import logging
+import threading
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import tinkerforge_mqtt
+
+class PublishSink(object):
+    """
+    Replaces the publish function of the paho client. Counts the published
+    messages and measures the latency from the moment a message is expected
+    on a topic until it is published.
+    """
+
+    def __init__(self, keep_messages=1000):
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.count = 0 # protected by lock
+        self.bytes = 0 # protected by lock
+        self.expected = {} # topic -> deque of timestamps, protected by lock
+        self.latencies = [] # seconds, protected by lock
+        self.messages = deque(maxlen=keep_messages) # most recent (topic, payload), protected by lock
+        self.last_time = None # time of the most recent publish, protected by lock
+
+    def expect(self, topic, timestamp=None):
+        if timestamp == None:
+            timestamp = time.time()
+
+        with self.lock:
+            pending = self.expected.get(topic)
+
+            if pending is None:
+                pending = deque()
+                self.expected[topic] = pending
+
+            pending.append(timestamp)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        now = time.time()
+
+        with self.lock:
+            self.count += 1
+            self.bytes += len(payload) if payload is not None else 0
+            self.last_time = now
+            self.messages.append((topic, payload))
+
+            pending = self.expected.get(topic)
+
+            if pending:
+                self.latencies.append(now - pending.popleft())
+
+            self.condition.notify_all()
+
+    def wait(self, count, timeout):
+        deadline = time.time() + timeout
+
+        with self.lock:
+            while self.count < count:
+                remaining = deadline - time.time()
+
+                if remaining <= 0:
+                    return False
+
+                self.condition.wait(remaining)
+
+        return True
+
+    def take_latencies(self):
+        with self.lock:
+            latencies = self.latencies
+            self.latencies = []
+
+        return latencies
+
+    def reset(self):
+        with self.lock:
+            self.count = 0
+            self.bytes = 0
+            self.expected = {}
+            self.latencies = []
+            self.messages.clear()
+            self.last_time = None
+
+def create_bindings(global_prefix='tf/', ipcon_timeout=2.5, verbose=False, **kwargs):
+    """
+    Creates bindings that are connected to a PublishSink instead of a broker.
+    The keyword arguments are passed on to MQTTBindings.
+    """
+
+    bindings = tinkerforge_mqtt.MQTTBindings(verbose, True, False, False, global_prefix, ipcon_timeout,
+                                             None, None, None, False, None, **kwargs)
+
+    if not verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    sink = PublishSink()
+    bindings.mqttc.publish = sink.publish
+    bindings.was_connected = True
+
+    return bindings, sink
+
+def send_message(bindings, topic, payload=''):
+    # the topic is relative to the global prefix
+    bindings.on_message(bindings.mqttc, len(bindings.global_prefix),
+                        tinkerforge_mqtt.message_tup(bindings.global_prefix + topic, payload))
+
+def start_callback_processor(ipcon):
+    # what IPConnection.connect does for the callback path, without a socket
+    callback = tinkerforge_mqtt.IPConnection.CallbackContext()
+    callback.queue = tinkerforge_mqtt.queue.Queue()
+    callback.packet_dispatch_allowed = True
+    callback.lock = threading.Lock()
+    callback.thread = threading.Thread(name='Callback-Processor', target=ipcon.callback_loop, args=(callback,))
+    callback.thread.daemon = True
+    callback.thread.start()
+
+    ipcon.callback = callback
+
+def stop_callback_processor(ipcon):
+    callback = ipcon.callback
+
+    if callback is not None:
+        callback.queue.put((tinkerforge_mqtt.IPConnection.QUEUE_EXIT, None))
+        callback.thread.join()
+        ipcon.callback = None
+
+def get_free_port(host='localhost'):
+    # for tools started as separate processes, that can't report the port they got
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind((host, 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    return port
+
+def get_device_name(device_identifier):
+    # MQTT device name of a device identifier, None if unknown
+    for name, definition in tinkerforge_mqtt.device_definitions.items():
+        if definition[1] == device_identifier:
+            return name
+
+    return None
+
+INTEGER_RANGES = {
+    'b': (-(1 << 7), (1 << 7) - 1), 'B': (0, (1 << 8) - 1),
+    'h': (-(1 << 15), (1 << 15) - 1), 'H': (0, (1 << 16) - 1),
+    'i': (-(1 << 31), (1 << 31) - 1), 'I': (0, (1 << 32) - 1),
+    'q': (-(1 << 63), (1 << 63) - 1), 'Q': (0, (1 << 64) - 1)
+}
+
+def random_values(fmt, rng=random):
+    """
+    Random values for a payload format, in the form pack_payload expects and
+    unpack_payload returns them.
+    """
+
+    values = []
+
+    if len(fmt) == 0:
+        return values
+
+    for token in fmt.split(' '):
+        kind = token[-1]
+        count = int(token[:-1]) if len(token) > 1 else None
+
+        if kind == '!':
+            value = [rng.random() < 0.5 for _ in range(count or 1)]
+        elif kind == 'c':
+            value = [chr(rng.randint(32, 126)) for _ in range(count or 1)]
+        elif kind == 's':
+            # strings are zero terminated unless they use the full length
+            value = ''.join(chr(rng.randint(32, 126)) for _ in range(rng.randint(0, count or 1)))
+        elif kind == 'f':
+            value = [float(rng.randint(-100000, 100000)) / 4 for _ in range(count or 1)] # exact in single precision
+        else:
+            low, high = INTEGER_RANGES[kind]
+            value = [rng.randint(low, high) for _ in range(count or 1)]
+
+        if kind == 's':
+            values.append(value)
+        elif count is None:
+            values.append(value[0])
+        else:
+            values.append(tuple(value))
+
+    return values
+
+def summarize_latencies(latencies):
+    # milliseconds
+    ordered = sorted(latencies)
+    summary = {"count": len(ordered)}
+
+    for percentile in [50, 95, 99]:
+        value = tinkerforge_mqtt.get_percentile(ordered, percentile)
+        summary["p{}".format(percentile)] = round(value * 1000, 3) if value is not None else None
+
+    summary["max"] = round(ordered[-1] * 1000, 3) if len(ordered) > 0 else None
+
+    return summary
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Minimal MQTT 3.1.1 broker for benchmarks and tests. It supports what the
+bindings and the benchmark clients use: CONNECT, SUBSCRIBE with + and #
+wildcards, UNSUBSCRIBE, PUBLISH with QoS 0 and 1 (always delivered with
+QoS 0), retained messages, PINGREQ and DISCONNECT. There is no
+authentication, no persistence and no will message.
+"""
+
+import sys
+import time
+import socket
+import struct
+import logging
+import argparse
+import threading
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+logger = logging.getLogger('MQTT test broker')
+
+def topic_matches(topic_filter, topic):
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+
+    for i, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+
+        if i >= len(topic_levels):
+            return False
+
+        if level != '+' and level != topic_levels[i]:
+            return False
+
+    return len(filter_levels) == len(topic_levels)
+
+def encode_remaining_length(length):
+    encoded = bytearray()
+
+    while True:
+        byte = length % 128
+        length //= 128
+
+        if length > 0:
+            byte |= 0x80
+
+        encoded.append(byte)
+
+        if length == 0:
+            return bytes(encoded)
+
+def encode_string(value):
+    data = value.encode('utf-8')
+
+    return struct.pack('>H', len(data)) + data
+
+def create_publish_packet(topic, payload, retain=False):
+    body = encode_string(topic) + payload
+
+    return bytes(bytearray([(PUBLISH << 4) | (1 if retain else 0)])) + encode_remaining_length(len(body)) + body
+
+class BrokerClient(object):
+    def __init__(self, broker, sock):
+        self.broker = broker
+        self.socket = sock
+        self.send_lock = threading.Lock()
+        self.subscriptions = set() # protected by broker lock
+        self.client_id = None
+
+    def send(self, data):
+        try:
+            with self.send_lock:
+                self.socket.sendall(data)
+        except socket.error:
+            pass # the read loop notices the disconnect
+
+    def recv_exactly(self, length):
+        data = b''
+
+        while len(data) < length:
+            chunk = self.socket.recv(length - len(data))
+
+            if len(chunk) == 0:
+                raise EOFError()
+
+            data += chunk
+
+        return data
+
+    def read_packet(self):
+        first = bytearray(self.recv_exactly(1))[0]
+        multiplier = 1
+        length = 0
+
+        while True:
+            byte = bytearray(self.recv_exactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+
+            if byte & 0x80 == 0:
+                break
+
+        return first >> 4, first & 0x0F, self.recv_exactly(length)
+
+    def loop(self):
+        try:
+            while True:
+                packet_type, flags, body = self.read_packet()
+
+                if packet_type == CONNECT:
+                    self.send(bytes(bytearray([CONNACK << 4, 2, 0, 0])))
+                elif packet_type == PUBLISH:
+                    self.handle_publish(flags, body)
+                elif packet_type == SUBSCRIBE:
+                    self.handle_subscribe(body)
+                elif packet_type == UNSUBSCRIBE:
+                    self.handle_unsubscribe(body)
+                elif packet_type == PINGREQ:
+                    self.send(bytes(bytearray([PINGRESP << 4, 0])))
+                elif packet_type == DISCONNECT:
+                    break
+        except (EOFError, socket.error):
+            pass
+        finally:
+            self.broker.remove_client(self)
+
+            try:
+                self.socket.close()
+            except socket.error:
+                pass
+
+    def handle_publish(self, flags, body):
+        qos = (flags >> 1) & 0x03
+        retain = (flags & 0x01) != 0
+        topic_length = struct.unpack('>H', body[:2])[0]
+        topic = body[2:2 + topic_length].decode('utf-8')
+        offset = 2 + topic_length
+
+        if qos > 0:
+            packet_id = body[offset:offset + 2]
+            offset += 2
+            self.send(bytes(bytearray([PUBACK << 4, 2])) + packet_id)
+
+        self.broker.publish(topic, body[offset:], retain)
+
+    def handle_subscribe(self, body):
+        packet_id = body[:2]
+        offset = 2
+        topic_filters = []
+
+        while offset < len(body):
+            length = struct.unpack('>H', body[offset:offset + 2])[0]
+            topic_filters.append(body[offset + 2:offset + 2 + length].decode('utf-8'))
+            offset += 2 + length + 1 # requested QoS
+
+        self.send(bytes(bytearray([SUBACK << 4, 2 + len(topic_filters)])) + packet_id + b'\x00' * len(topic_filters))
+        self.broker.subscribe(self, topic_filters)
+
+    def handle_unsubscribe(self, body):
+        packet_id = body[:2]
+        offset = 2
+        topic_filters = []
+
+        while offset < len(body):
+            length = struct.unpack('>H', body[offset:offset + 2])[0]
+            topic_filters.append(body[offset + 2:offset + 2 + length].decode('utf-8'))
+            offset += 2 + length
+
+        self.broker.unsubscribe(self, topic_filters)
+        self.send(bytes(bytearray([UNSUBACK << 4, 2])) + packet_id)
+
+class MQTTTestBroker(object):
+    def __init__(self, host='localhost', port=1883):
+        self.host = host
+        self.port = port
+        self.lock = threading.Lock()
+        self.clients = [] # protected by lock
+        self.retained = {} # topic -> payload, protected by lock
+        self.messages = 0 # published messages, protected by lock
+        self.server_socket = None
+
+    def start(self):
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(16)
+        self.port = self.server_socket.getsockname()[1] # if port 0 was requested
+
+        thread = threading.Thread(name='Broker-Acceptor', target=self.accept_loop)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        try:
+            self.server_socket.close()
+        except socket.error:
+            pass
+
+        with self.lock:
+            clients = list(self.clients)
+
+        for client in clients:
+            try:
+                client.socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def accept_loop(self):
+        while True:
+            try:
+                sock, address = self.server_socket.accept()
+            except socket.error:
+                return
+
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = BrokerClient(self, sock)
+
+            with self.lock:
+                self.clients.append(client)
+
+            thread = threading.Thread(name='Broker-Client', target=client.loop)
+            thread.daemon = True
+            thread.start()
+
+    def remove_client(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def subscribe(self, client, topic_filters):
+        with self.lock:
+            client.subscriptions.update(topic_filters)
+            retained = [(topic, payload) for topic, payload in self.retained.items()
+                        if any(topic_matches(topic_filter, topic) for topic_filter in topic_filters)]
+
+        for topic, payload in retained:
+            client.send(create_publish_packet(topic, payload, True))
+
+    def unsubscribe(self, client, topic_filters):
+        with self.lock:
+            client.subscriptions.difference_update(topic_filters)
+
+    def publish(self, topic, payload, retain):
+        with self.lock:
+            self.messages += 1
+
+            if retain:
+                if len(payload) == 0:
+                    self.retained.pop(topic, None)
+                else:
+                    self.retained[topic] = payload
+
+            receivers = [client for client in self.clients
+                         if any(topic_matches(topic_filter, topic) for topic_filter in client.subscriptions)]
+
+        if len(receivers) > 0:
+            packet = create_publish_packet(topic, payload)
+
+            for client in receivers:
+                client.send(packet)
+
+def main():
+    parser = argparse.ArgumentParser(description='Minimal MQTT broker for benchmarks and tests')
+    parser.add_argument('--host', default='localhost', help='address to listen on (default: localhost)')
+    parser.add_argument('--port', type=int, default=1883, help='port to listen on (default: 1883)')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    broker = MQTTTestBroker(args.host, args.port)
+    broker.start()
+
+    logger.info('Listening on {0}:{1}'.format(args.host, broker.port))
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+
+    broker.stop()
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Replays the received callbacks of a packet capture (written by
+request/bindings/dump_capture) through the callback path of the bindings:
+IPConnection.handle_response, the callback queue, dispatch_packet and
+MQTTBindings.callback_function. No hardware, Brick Daemon or MQTT broker is
+needed, messages are published to a local sink.
+
+All callbacks found in the capture are registered before the replay starts.
+The result is printed as JSON: offered and achieved rate and the latency
+from handle_response to publish.
+"""
+
+import sys
+import time
+import json
+import argparse
+
+import harness
+from harness import tinkerforge_mqtt as tm
+
+def load_capture(path):
+    with open(path, 'rb') as f:
+        _, _, device_identifiers, records = tm.PacketCapture.read(f.read())
+
+    callbacks = []
+
+    for timestamp, direction, packet in records:
+        if direction != tm.TrafficTable.DIRECTION_IN or tm.get_sequence_number_from_data(packet) != 0:
+            continue
+
+        if tm.get_function_id_from_data(packet) == tm.IPConnection.CALLBACK_ENUMERATE:
+            device_identifiers[tm.get_uid_from_data(packet)] = tm.unpack_payload(packet[8:], '8s 8s c 3B 3B H B')[5]
+            continue
+
+        callbacks.append((timestamp, packet))
+
+    return device_identifiers, callbacks
+
+def register_callbacks(bindings, device_identifiers, callbacks):
+    # returns (uid, function ID) -> topic that is published once per packet. it
+    # is None for unknown devices and for high-level callbacks, those are
+    # published once per message that consists of multiple packets
+    topics = {}
+
+    for _, packet in callbacks:
+        key = (tm.get_uid_from_data(packet), tm.get_function_id_from_data(packet))
+
+        if key in topics:
+            continue
+
+        uid, function_id = key
+        device_name = harness.get_device_name(device_identifiers.get(uid))
+
+        if device_name is None:
+            topics[key] = None
+            continue
+
+        callback_name = tm.get_function_name(tm.devices[device_name], function_id)
+
+        if callback_name is None:
+            topics[key] = None
+            continue
+
+        topic = 'callback/{0}/{1}/{2}'.format(device_name, tm.base58encode(uid), callback_name)
+        harness.send_message(bindings, 'register/{0}/{1}/{2}'.format(device_name, tm.base58encode(uid), callback_name), 'true')
+        device = bindings.ipcon.devices[uid]
+
+        # the device type is known from the capture, don't ask the (absent) device
+        device.device_identifier_check = tm.Device.DEVICE_IDENTIFIER_CHECK_MATCH
+
+        if -function_id in device.high_level_callbacks:
+            topics[key] = None
+        else:
+            topics[key] = bindings.global_prefix + topic
+
+    return topics
+
+def replay(bindings, sink, callbacks, topics, speed, repeat):
+    ipcon = bindings.ipcon
+    fed = 0
+    start = time.time()
+
+    if len(callbacks) == 0:
+        return fed, start, start
+
+    first = callbacks[0][0]
+    span = callbacks[-1][0] - first
+
+    for iteration in range(repeat):
+        offset = iteration * span
+
+        for timestamp, packet in callbacks:
+            if speed > 0:
+                delay = start + (timestamp - first + offset) / speed - time.time()
+
+                if delay > 0:
+                    time.sleep(delay)
+
+            topic = topics.get((tm.get_uid_from_data(packet), tm.get_function_id_from_data(packet)))
+
+            if topic is not None:
+                sink.expect(topic)
+
+            ipcon.handle_response(packet)
+            fed += 1
+
+    return fed, start, time.time()
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a packet capture through the callback path of the MQTT bindings')
+    parser.add_argument('capture_file', help='capture file written by request/bindings/dump_capture')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='replay speed factor, 0 replays as fast as possible (default: 1.0)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='number of times the capture is replayed (default: 1)')
+    parser.add_argument('--timeout', type=float, default=10.0,
+                        help='seconds to wait for outstanding publishes after the replay (default: 10.0)')
+    parser.add_argument('--verbose', action='store_true', help='show the log output of the bindings')
+
+    args = parser.parse_args()
+
+    device_identifiers, callbacks = load_capture(args.capture_file)
+    bindings, sink = harness.create_bindings(verbose=args.verbose)
+    harness.start_callback_processor(bindings.ipcon)
+
+    topics = register_callbacks(bindings, device_identifiers, callbacks)
+    sink.reset() # registration responses
+
+    expected = sum(1 for _, packet in callbacks
+                   if topics.get((tm.get_uid_from_data(packet), tm.get_function_id_from_data(packet))) is not None) * args.repeat
+
+    fed, start, feed_end = replay(bindings, sink, callbacks, topics, args.speed, max(1, args.repeat))
+    complete = sink.wait(expected, args.timeout)
+    feed_duration = feed_end - start
+    duration = sink.last_time - start if sink.last_time is not None else 0.0
+
+    harness.stop_callback_processor(bindings.ipcon)
+
+    capture_span = callbacks[-1][0] - callbacks[0][0] if len(callbacks) > 0 else 0.0
+
+    result = {
+        "capture": args.capture_file,
+        "speed": args.speed,
+        "packets": fed,
+        "publishes": sink.count,
+        "untimed_packets": fed - expected,
+        "complete": complete,
+        "offered_rate": round(fed / (capture_span * max(1, args.repeat) / args.speed), 1) if args.speed > 0 and capture_span > 0 else None,
+        "feed_rate": round(fed / feed_duration, 1) if feed_duration > 0 else None,
+        "publish_rate": round(sink.count / duration, 1) if duration > 0 else None,
+        "latency_ms": harness.summarize_latencies(sink.take_latencies())
+    }
+
+    print(json.dumps(result, indent=2, sort_keys=True))
+
+    return 0 if complete else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
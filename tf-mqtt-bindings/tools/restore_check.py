@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Checks that the callback configuration of a device reaches the Brick Daemon
+emulator again after it was lost, with and without authentication. The
+bindings run in this process against the emulator. A callback configuration
+setter is called once, then the state of the virtual device is cleared and
+the following cases are checked:
+
+- reconnect: the emulator drops the connection, the bindings auto-reconnect
+  and replay the recorded configuration
+- restart: new bindings restore the configuration from the registration file
+  written by the first ones and replay it after connecting
+
+Each case passes if the state of the virtual device equals the state after
+the original call. The result is written as JSON, the exit code is 1 if a
+case failed.
+"""
+
+import sys
+import os
+import time
+import json
+import shutil
+import argparse
+import tempfile
+
+import harness
+from harness import tinkerforge_mqtt as tm
+from brickd_emulator import BrickdEmulator, create_devices
+
+def wait_for_state(device, expected, timeout):
+    deadline = time.time() + timeout
+
+    while time.time() < deadline:
+        with device.lock:
+            if device.state == expected:
+                return True
+
+        time.sleep(0.05)
+
+    return False
+
+def run_cases(args, auth_secret, directory):
+    registration_file = os.path.join(directory, 'registrations-{0}.json'.format('auth' if auth_secret is not None else 'no-auth'))
+    device = create_devices(1, [args.device_type])[0]
+    emulator = BrickdEmulator([device], 'localhost', 0, auth_secret=auth_secret)
+    emulator.start()
+
+    bindings = None
+    results = {}
+
+    try:
+        bindings, _ = harness.create_bindings(verbose=args.verbose, registration_file=registration_file)
+        bindings.connect_to_brickd('localhost', emulator.port, auth_secret or '')
+        harness.send_message(bindings, 'request/{0}/{1}/{2}'.format(args.device_type, device.uid, args.function), args.args)
+
+        with device.lock:
+            expected = dict(device.state)
+            device.state.clear()
+
+        if len(expected) == 0:
+            raise Exception('{0} did not change the state of the virtual device'.format(args.function))
+
+        emulator.disconnect_clients()
+        results['reconnect'] = wait_for_state(device, expected, args.timeout)
+
+        bindings.save_registrations()
+        bindings.ipcon.disconnect()
+        bindings = None
+
+        with device.lock:
+            device.state.clear()
+
+        bindings, _ = harness.create_bindings(verbose=args.verbose, registration_file=registration_file)
+        bindings.restore_registrations()
+        bindings.connect_to_brickd('localhost', emulator.port, auth_secret or '')
+        results['restart'] = wait_for_state(device, expected, args.timeout)
+    finally:
+        if bindings is not None:
+            bindings.ipcon.disconnect()
+
+        emulator.stop()
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Checks the callback configuration replay of the MQTT bindings')
+    parser.add_argument('--device-type', default='temperature_v2_bricklet',
+                        help='MQTT name of the device type (default: temperature_v2_bricklet)')
+    parser.add_argument('--function', default='set_temperature_callback_configuration',
+                        help='callback configuration setter to call (default: set_temperature_callback_configuration)')
+    parser.add_argument('--args', default='{"period": 1000, "value_has_to_change": false, "option": "off", "min": 0, "max": 0}',
+                        help='JSON arguments of the setter')
+    parser.add_argument('--auth-secret', default='s3cret', help='secret of the cases with authentication (default: s3cret)')
+    parser.add_argument('--timeout', type=float, default=5.0, help='seconds to wait for the replay (default: 5)')
+    parser.add_argument('--verbose', action='store_true', help='show the log output of the bindings')
+
+    args = parser.parse_args()
+
+    if args.device_type not in tm.devices:
+        parser.error('unknown device type {0}'.format(args.device_type))
+
+    if not tm.MQTTCallbackDevice.is_callback_configuration_function(args.function) or \
+       args.function not in tm.devices[args.device_type].functions:
+        parser.error('{0} has no callback configuration setter {1}'.format(args.device_type, args.function))
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        result = {
+            'device_type': args.device_type,
+            'function': args.function,
+            'no_auth': run_cases(args, None, directory),
+            'auth': run_cases(args, args.auth_secret, directory)
+        }
+    finally:
+        shutil.rmtree(directory)
+
+    result['passed'] = all(all(cases.values()) for cases in [result['no_auth'], result['auth']])
+
+    print(json.dumps(result, indent=2, sort_keys=True))
+
+    return 0 if result['passed'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Soak test that looks for resource leaks. The bindings run as a separate
+process against the Brick Daemon emulator (sending callbacks) and a minimal
+MQTT broker, both in this process. Until the duration is over, cycles of the
+following actions are run:
+
+- register and deregister a callback on all devices
+- request/bindings/reset_callbacks and register the callbacks again
+- disconnect the bindings from the emulator and wait for the reconnect
+- replace a device by one of another type with the same UID, call both
+  types, then put the original device back
+- flood all devices with concurrent requests
+
+After every cycle, once the bindings had a moment to settle, RSS, threads
+and open file descriptors of the bindings process (from /proc) and the queue
+sizes and device count from callback/bindings/stats are sampled. Samples of
+the warmup period are ignored. The test fails if the median of the last
+third of the samples exceeds the median of the first third by more than the
+allowed growth of that resource.
+
+The samples and the verdict are written as JSON, the exit code is 1 if a
+resource grew.
+"""
+
+import sys
+import os
+import time
+import json
+import random
+import logging
+import argparse
+import platform
+import threading
+
+from harness import tinkerforge_mqtt as tm
+from brickd_emulator import BrickdEmulator, VirtualDevice, create_devices
+from mqtt_test_broker import MQTTTestBroker
+from benchmark_e2e import GLOBAL_PREFIX, ResponseWaiter, start_bindings, wait_for_connection
+
+logger = logging.getLogger('Soak test')
+
+class SoakClient(ResponseWaiter):
+    # also keeps the most recent statistics message of the bindings
+    def __init__(self, host, port):
+        self.stats_lock = threading.Lock()
+        self.stats = None # protected by stats_lock
+
+        ResponseWaiter.__init__(self, host, port)
+
+    def on_connect(self, mqttc, userdata, flags, rc):
+        mqttc.subscribe(GLOBAL_PREFIX + 'callback/bindings/stats')
+        ResponseWaiter.on_connect(self, mqttc, userdata, flags, rc)
+
+    def on_message(self, mqttc, userdata, msg):
+        if msg.topic == GLOBAL_PREFIX + 'callback/bindings/stats':
+            with self.stats_lock:
+                self.stats = json.loads(msg.payload.decode('utf-8'))
+        else:
+            ResponseWaiter.on_message(self, mqttc, userdata, msg)
+
+    def get_stats(self):
+        with self.stats_lock:
+            return self.stats
+
+    def send(self, topic, payload):
+        # for messages without a response, e.g. callback registrations
+        self.mqttc.publish(GLOBAL_PREFIX + topic, payload)
+
+def get_process_resources(pid):
+    # RSS in bytes, threads and open file descriptors, None where /proc is not available
+    resources = {'rss': None, 'threads': None, 'fds': None}
+
+    try:
+        with open('/proc/{0}/status'.format(pid)) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    resources['rss'] = int(line.split()[1]) * 1024
+                elif line.startswith('Threads:'):
+                    resources['threads'] = int(line.split()[1])
+
+        resources['fds'] = len(os.listdir('/proc/{0}/fd'.format(pid)))
+    except (IOError, OSError):
+        pass
+
+    return resources
+
+def get_getter(device_name):
+    # first zero-argument getter of a device type, other than get_identity
+    functions = tm.devices[device_name].functions
+
+    for name in sorted(functions):
+        info = functions[name]
+
+        if isinstance(info, tm.FunctionInfo) and name.startswith('get_') and name != 'get_identity' and len(info.arg_names) == 0:
+            return name
+
+    return 'get_identity'
+
+def get_median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+
+    if len(ordered) % 2 == 1:
+        return ordered[middle]
+
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+class SoakTest(object):
+    def __init__(self, args, client, emulator, devices):
+        self.args = args
+        self.client = client
+        self.emulator = emulator
+        self.devices = devices
+        self.rng = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.counts = {'requests': 0, 'errors': 0, 'timeouts': 0, 'reconnects': 0, 'replacements': 0} # protected by lock
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def request(self, topic, payload=''):
+        response = self.client.request(topic, payload, self.args.timeout)
+        self.count('requests')
+
+        if response is None:
+            self.count('timeouts')
+        elif '_ERROR' in response:
+            self.count('errors') # expected for calls to a replaced device
+
+        return response
+
+    def get_topic(self, kind, device, name):
+        return '{0}/{1}/{2}/{3}'.format(kind, device.device_name, device.uid, name)
+
+    def register_callbacks(self, register):
+        for device in self.devices:
+            self.client.send(self.get_topic('register', device, self.args.callback), 'true' if register else 'false')
+
+        # registrations have no response, a request afterwards makes sure they were handled
+        self.request('request/ip_connection/get_connection_state')
+
+    def reset_callbacks(self):
+        self.client.send('request/bindings/reset_callbacks', '') # has no response
+        self.register_callbacks(True)
+
+    def reconnect(self):
+        self.emulator.disconnect_clients()
+        time.sleep(0.5) # the bindings notice the disconnect with a short delay
+
+        if not wait_for_connection(self.client, self.args.timeout * 4):
+            raise Exception('Bindings did not reconnect to the Brick Daemon emulator')
+
+        self.count('reconnects')
+
+    def replace_device(self):
+        original = self.rng.choice(self.devices)
+        replacement = VirtualDevice(original.uid, self.args.replacement_type, original.position, self.rng)
+
+        # get_identity works regardless of the device type, use another getter
+        self.emulator.add_device(replacement) # replaces the device with the same UID
+        self.request(self.get_topic('request', original, get_getter(original.device_name))) # wrong device type now
+        self.request(self.get_topic('request', replacement, get_getter(replacement.device_name)))
+        self.emulator.add_device(original)
+        self.request(self.get_topic('request', original, get_getter(original.device_name)))
+        self.count('replacements')
+
+    def flood(self):
+        deadline = time.time() + self.args.flood_duration
+
+        def worker(index):
+            position = index
+
+            while time.time() < deadline:
+                device = self.devices[position % len(self.devices)]
+                position += 1
+                self.request(self.get_topic('request', device, 'get_identity') + '/flood{0}'.format(index))
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(self.args.flood_concurrency)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+    def run_cycle(self):
+        self.register_callbacks(True)
+        self.register_callbacks(False)
+        self.reset_callbacks()
+        self.reconnect()
+        self.replace_device()
+        self.flood()
+        self.register_callbacks(False)
+
+    def sample(self, pid, start):
+        sample = get_process_resources(pid)
+        stats = self.client.get_stats()
+        sample['time'] = round(time.time() - start, 1)
+
+        if stats is not None:
+            sample['devices'] = stats['devices']
+
+            for name, value in stats['queues'].items():
+                sample['queue_' + name] = value
+
+            if sample['rss'] is None:
+                sample['rss'] = stats['memory']['rss']
+
+            if sample['threads'] is None:
+                sample['threads'] = stats['threads']
+
+        return sample
+
+def check_growth(samples, limits):
+    # compares the medians of the first and the last third of the samples
+    third = len(samples) // 3
+
+    if third < 1:
+        return {}, ['not enough samples after the warmup to detect growth']
+
+    results = {}
+    failures = []
+
+    for name, limit in sorted(limits.items()):
+        first = [sample[name] for sample in samples[:third] if sample.get(name) is not None]
+        last = [sample[name] for sample in samples[-third:] if sample.get(name) is not None]
+
+        if len(first) == 0 or len(last) == 0:
+            continue
+
+        growth = get_median(last) - get_median(first)
+        results[name] = {'first': get_median(first), 'last': get_median(last), 'growth': growth, 'limit': limit}
+
+        if growth > limit:
+            failures.append('{0} grew by {1}, more than {2}'.format(name, growth, limit))
+
+    return results, failures
+
+def main():
+    parser = argparse.ArgumentParser(description='Soak test of the MQTT bindings with resource leak detection')
+    parser.add_argument('--duration', type=float, default=600.0, help='seconds to run (default: 600)')
+    parser.add_argument('--warmup', type=float, default=60.0, help='seconds before samples are used (default: 60)')
+    parser.add_argument('--devices', type=int, default=10, help='number of emulated devices (default: 10)')
+    parser.add_argument('--device-type', default='temperature_v2_bricklet',
+                        help='MQTT name of the device type (default: temperature_v2_bricklet)')
+    parser.add_argument('--replacement-type', default='humidity_v2_bricklet',
+                        help='device type that temporarily replaces a device (default: humidity_v2_bricklet)')
+    parser.add_argument('--callback', default='temperature', help='callback to register (default: temperature)')
+    parser.add_argument('--callback-rate', type=float, default=10.0,
+                        help='callback rate per device in Hz (default: 10)')
+    parser.add_argument('--flood-duration', type=float, default=2.0, help='seconds of request flood per cycle (default: 2)')
+    parser.add_argument('--flood-concurrency', type=int, default=8, help='concurrent requesters of the flood (default: 8)')
+    parser.add_argument('--timeout', type=float, default=5.0, help='seconds to wait for a response (default: 5)')
+    parser.add_argument('--settle', type=float, default=2.0, help='seconds between a cycle and its sample (default: 2)')
+    parser.add_argument('--max-rss-growth', type=float, default=5.0, help='allowed RSS growth in MiB (default: 5)')
+    parser.add_argument('--max-thread-growth', type=int, default=0, help='allowed thread count growth (default: 0)')
+    parser.add_argument('--max-fd-growth', type=int, default=0, help='allowed file descriptor growth (default: 0)')
+    parser.add_argument('--max-queue-growth', type=int, default=10, help='allowed growth of each queue (default: 10)')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the random values')
+    parser.add_argument('--output', default=None, help='write the JSON result to this file instead of stdout')
+    parser.add_argument('--verbose', action='store_true', help='show the output of the bindings')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger().setLevel(logging.INFO) # harness lowers the level for the bindings
+
+    for device_type in [args.device_type, args.replacement_type]:
+        if device_type not in tm.devices:
+            parser.error('unknown device type {0}'.format(device_type))
+
+    if args.callback not in tm.devices[args.device_type].callbacks:
+        parser.error('{0} has no callback {1}'.format(args.device_type, args.callback))
+
+    broker = MQTTTestBroker('localhost', 0)
+    broker.start()
+
+    devices = create_devices(args.devices, [args.device_type], rng=random.Random(args.seed))
+    emulator = BrickdEmulator(devices, 'localhost', 0, callback_rate=args.callback_rate,
+                              callback_names=[args.callback], seed=args.seed)
+    emulator.start()
+
+    process = start_bindings('localhost', broker.port, emulator.port, args.verbose, ['--stats-interval', '1'])
+    client = None
+    samples = []
+    start = time.time()
+
+    try:
+        client = SoakClient('localhost', broker.port)
+
+        if not wait_for_connection(client, 30):
+            raise Exception('Bindings did not connect to the Brick Daemon emulator')
+
+        test = SoakTest(args, client, emulator, devices)
+        cycles = 0
+
+        while time.time() - start < args.duration:
+            test.run_cycle()
+            cycles += 1
+            time.sleep(args.settle)
+
+            sample = test.sample(process.pid, start)
+            sample['cycle'] = cycles
+            samples.append(sample)
+
+            logger.info('Cycle {0}: rss {1}, threads {2}, fds {3}'.format(cycles, sample['rss'], sample['threads'], sample['fds']))
+
+            if process.poll() is not None:
+                raise Exception('Bindings exited with code {0}'.format(process.returncode))
+    finally:
+        if client is not None:
+            client.close()
+
+        if process.poll() is None:
+            process.terminate()
+            process.wait()
+
+        emulator.stop()
+        broker.stop()
+
+    limits = {'rss': args.max_rss_growth * 1024 * 1024, 'threads': args.max_thread_growth, 'fds': args.max_fd_growth,
+              'devices': 0}
+
+    for name in samples[-1] if len(samples) > 0 else []:
+        if name.startswith('queue_'):
+            limits[name] = args.max_queue_growth
+
+    growth, failures = check_growth([sample for sample in samples if sample['time'] >= args.warmup], limits)
+
+    result = {
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'duration': round(time.time() - start, 1),
+        'cycles': len(samples),
+        'actions': test.counts,
+        'emulator': emulator.get_counters(),
+        'growth': growth,
+        'failures': failures,
+        'passed': len(failures) == 0,
+        'samples': samples
+    }
+
+    output = json.dumps(result, indent=2, sort_keys=True)
+
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+    return 0 if len(failures) == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())